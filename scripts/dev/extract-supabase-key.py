@@ -7,16 +7,30 @@ This script provides multiple methods to retrieve the fresh anon public API key
 from Supabase dashboard and update the .env.local file:
 
 1. Automated browser extraction (requires Selenium)
-2. Manual extraction with guided steps
+2. Manual extraction with guided steps (auto-detects the key on the
+   clipboard when pyperclip is installed)
 3. Direct API key input and validation
 
 Usage: python3 scripts/extract-supabase-key.py [options]
+
+Options:
+  --manual        Skip Selenium entirely and go straight to manual extraction
+  --selenium      Try Selenium even if chromedriver is not on PATH
+  -h, --help      Show this help
+
+Environment:
+  REUSE_CHROME=1  Attach to an already-running Chrome instead of launching a
+                  new one on every run. Start it once with:
+                    google-chrome --remote-debugging-port=9222 --user-data-dir=/tmp/chrome_user_data &
 """
 
 import os
 import re
+import json
+import base64
 import sys
 import time
+import shutil
 import subprocess
 from pathlib import Path
 
@@ -26,76 +40,168 @@ DASHBOARD_URL = f"https://app.supabase.com/project/{PROJECT_REF}/settings/api"
 SCRIPT_DIR = Path(__file__).parent
 PROJECT_DIR = SCRIPT_DIR.parent
 ENV_FILE = PROJECT_DIR / ".env.local"
+CHROME_USER_DATA_DIR = "/tmp/chrome_user_data"
+CHROME_DEBUGGER_ADDRESS = "127.0.0.1:9222"
+ANON_KEY_PREFIX = "NEXT_PUBLIC_SUPABASE_ANON_KEY="
+
+# Supabase anon keys are JWTs: three base64url segments separated by dots
+_JWT_RE = re.compile(r'^eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+$')
+_MIN_KEY_LENGTH = 100
+
+# Attribute selectors for DOM nodes that may hold the anon key on the dashboard.
+# Tag and class lookups (code, pre, .api-key, .anon-key) use the native
+# getElementsBy* APIs in _CANDIDATE_TEXT_JS, which skip the selector engine.
+_ATTRIBUTE_SELECTORS = ",".join([
+    "[data-testid*='anon']",
+    "[data-testid*='api-key']"
+])
+
+# URLs the dashboard redirects to when the session is not authenticated
+_LOGIN_URL_PATTERN = r"login|auth|sign-in"
+
+# Collects candidate texts in one WebDriver round-trip instead of one per element.
+# Order matters: the anon/api-key testid nodes are collected first so the scan
+# prefers them over generic code/pre blocks (which may hold the service_role key).
+_CANDIDATE_TEXT_JS = """
+const texts = [];
+const collect = (nodes) => { for (const e of nodes) texts.push(e.innerText); };
+collect(document.querySelectorAll(arguments[0]));
+collect(document.getElementsByTagName('code'));
+collect(document.getElementsByTagName('pre'));
+collect(document.getElementsByClassName('api-key'));
+collect(document.getElementsByClassName('anon-key'));
+return texts;
+"""
 
 def create_backup():
-    """Create a backup of the .env.local file"""
+    """Create a backup of the .env.local file
+
+    Returns (backup_file, content, mtime_ns) so update_env_file can reuse the
+    content and detect edits made while the key was being extracted.
+    """
     if not ENV_FILE.exists():
         print(f"❌ Error: .env.local file not found at {ENV_FILE}")
         sys.exit(1)
 
     backup_file = ENV_FILE.with_suffix(f".local.backup.{int(time.time())}")
-    backup_file.write_text(ENV_FILE.read_text())
+    shutil.copy2(ENV_FILE, backup_file)
     print(f"💾 Created backup: {backup_file}")
-    return backup_file
+    mtime_ns = ENV_FILE.stat().st_mtime_ns
+    return backup_file, ENV_FILE.read_text(), mtime_ns
+
+def _looks_like_jwt(text):
+    """Cheap shape check run before decoding the JWT payload"""
+    return len(text) >= _MIN_KEY_LENGTH and _JWT_RE.fullmatch(text) is not None
+
+def _jwt_role(token):
+    """Return the 'role' claim from a JWT's payload, or None if unreadable"""
+    payload = token.split('.', 2)[1]
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except ValueError:
+        return None
+    return claims.get("role") if isinstance(claims, dict) else None
 
 def validate_api_key(api_key):
     """Validate the format of the API key"""
     if not api_key:
         return False, "API key is empty"
 
-    if not api_key.startswith('eyJ'):
-        return False, "JWT tokens should start with 'eyJ'"
-
-    if '.' not in api_key:
-        return False, "JWT tokens should contain dots"
-
-    parts = api_key.split('.')
-    if len(parts) != 3:
-        return False, "JWT tokens should have exactly 3 parts separated by dots"
+    if _looks_like_jwt(api_key):
+        # Never accept e.g. the service_role key into a NEXT_PUBLIC_ variable
+        role = _jwt_role(api_key)
+        if role == "anon":
+            return True, "Valid"
+        return False, f"Not the anon public key (JWT role is {role!r}, expected 'anon')"
 
-    if len(api_key) < 100:
+    if len(api_key) < _MIN_KEY_LENGTH:
         return False, "API key seems too short"
 
-    return True, "Valid"
-
-def update_env_file(new_api_key):
-    """Update the .env.local file with the new API key"""
-    content = ENV_FILE.read_text()
+    if not api_key.startswith('eyJ'):
+        return False, "JWT tokens should start with 'eyJ'"
 
-    # Pattern to match the existing NEXT_PUBLIC_SUPABASE_ANON_KEY line
-    pattern = r'NEXT_PUBLIC_SUPABASE_ANON_KEY=.*'
-    replacement = f'NEXT_PUBLIC_SUPABASE_ANON_KEY="{new_api_key}"'
+    if api_key.count('.') != 2:
+        return False, "JWT tokens should have exactly 3 parts separated by dots"
 
-    if re.search(pattern, content):
-        # Replace existing key
-        new_content = re.sub(pattern, replacement, content)
+    return False, "JWT tokens should only contain base64url characters"
+
+def current_anon_key(content):
+    """Return the NEXT_PUBLIC_SUPABASE_ANON_KEY value in content, if any"""
+    key = None
+    for line in content.splitlines():
+        if line.startswith(ANON_KEY_PREFIX):
+            # Last definition wins, as in dotenv
+            key = line[len(ANON_KEY_PREFIX):].strip().strip('"\'')
+    return key
+
+def update_env_file(new_api_key, content, mtime_ns):
+    """Update the .env.local file with the new API key
+
+    content and mtime_ns are as returned by create_backup(); the file is
+    re-read if it was modified since then so those edits are not lost.
+    """
+    if ENV_FILE.stat().st_mtime_ns != mtime_ns:
+        print("ℹ️ .env.local changed since the backup, re-reading it")
+        content = ENV_FILE.read_text()
+
+    replacement = f'{ANON_KEY_PREFIX}"{new_api_key}"\n'
+
+    # Single pass over the lines, rewriting every existing definition in
+    # place (dotenv lets the last one win, so none may be left stale)
+    lines = content.splitlines(keepends=True)
+    found = False
+    for i, line in enumerate(lines):
+        if line.startswith(ANON_KEY_PREFIX):
+            lines[i] = replacement
+            found = True
+
+    if found:
         print("✅ Updated existing NEXT_PUBLIC_SUPABASE_ANON_KEY")
     else:
         # Add new key
-        new_content = content.rstrip() + f"\n{replacement}\n"
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        lines.append(replacement)
         print("✅ Added new NEXT_PUBLIC_SUPABASE_ANON_KEY")
 
-    ENV_FILE.write_text(new_content)
+    ENV_FILE.write_text("".join(lines))
     print("📝 .env.local file updated successfully!")
 
+def _on_login_page(driver):
+    """Whether the dashboard redirected to a login/auth page"""
+    return re.search(_LOGIN_URL_PATTERN, driver.current_url) is not None
+
+def _scan_for_key(driver):
+    """Return the first valid anon key among the candidate texts, or None"""
+    texts = driver.execute_script(_CANDIDATE_TEXT_JS, _ATTRIBUTE_SELECTORS) or []
+    for text in texts:
+        text = (text or "").strip()
+        if validate_api_key(text)[0]:
+            return text
+    return None
+
 def try_selenium_extraction():
     """Try to extract API key using Selenium WebDriver"""
     try:
         from selenium import webdriver
-        from selenium.webdriver.common.by import By
         from selenium.webdriver.support.ui import WebDriverWait
-        from selenium.webdriver.support import expected_conditions as EC
         from selenium.webdriver.chrome.options import Options
+        from selenium.common.exceptions import JavascriptException, TimeoutException
 
         print("🤖 Attempting automated extraction with Selenium...")
 
         # Configure Chrome options
         chrome_options = Options()
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
+        if os.environ.get("REUSE_CHROME"):
+            # Attach to a running Chrome started with --remote-debugging-port=9222
+            chrome_options.debugger_address = CHROME_DEBUGGER_ADDRESS
+            print(f"🔌 Attaching to running Chrome at {CHROME_DEBUGGER_ADDRESS}")
+        else:
+            chrome_options.add_argument("--no-sandbox")
+            chrome_options.add_argument("--disable-dev-shm-usage")
 
-        # Try to use existing Chrome session (if user is logged in)
-        chrome_options.add_argument("--user-data-dir=/tmp/chrome_user_data")
+            # Try to use existing Chrome session (if user is logged in)
+            chrome_options.add_argument(f"--user-data-dir={CHROME_USER_DATA_DIR}")
 
         driver = webdriver.Chrome(options=chrome_options)
 
@@ -103,40 +209,23 @@ def try_selenium_extraction():
             driver.get(DASHBOARD_URL)
             print(f"🌐 Navigated to: {DASHBOARD_URL}")
 
-            # Wait for page to load
-            time.sleep(5)
-
-            # Check if we're on login page
-            if "login" in driver.current_url or "auth" in driver.current_url:
+            # Poll until the key has rendered or the dashboard has redirected
+            # to sign-in; each poll is a single scan round-trip
+            wait = WebDriverWait(driver, 15, poll_frequency=0.2,
+                                 ignored_exceptions=[JavascriptException])
+            try:
+                found = wait.until(lambda d: _scan_for_key(d) or _on_login_page(d))
+            except TimeoutException:
+                found = None
+            api_key = found if isinstance(found, str) else None
+
+            if not api_key and _on_login_page(driver):
                 print("🔐 Login required. Please log in manually...")
                 input("Press Enter after you've logged in and are on the API settings page...")
-
-            # Look for API key using various strategies
-            selectors = [
-                "[data-testid*='anon']",
-                "[data-testid*='api-key']",
-                "code",
-                "pre",
-                ".api-key",
-                ".anon-key"
-            ]
-
-            api_key = None
-            for selector in selectors:
                 try:
-                    elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                    for element in elements:
-                        text = element.text.strip()
-                        if text.startswith('eyJ') and len(text) > 100:
-                            # Validate JWT format
-                            parts = text.split('.')
-                            if len(parts) == 3:
-                                api_key = text
-                                break
-                    if api_key:
-                        break
-                except:
-                    continue
+                    api_key = wait.until(_scan_for_key)
+                except TimeoutException:
+                    api_key = None
 
             if api_key:
                 print("✅ Found API key automatically!")
@@ -155,7 +244,39 @@ def try_selenium_extraction():
         print(f"❌ Selenium extraction failed: {e}")
         return None
 
-def manual_extraction():
+def poll_clipboard_for_key(current_key=None):
+    """Wait for a valid API key to be on the system clipboard
+
+    A key already on the clipboard is accepted straight away, except
+    current_key (the one already in .env.local), which is being replaced.
+    """
+    try:
+        import pyperclip
+    except ImportError:
+        print("ℹ️ pyperclip not available, falling back to paste. Install with: pip install pyperclip")
+        return None
+
+    print("📋 Copy the anon public API key to your clipboard (Ctrl+C to paste it instead)...")
+    try:
+        while True:
+            api_key = pyperclip.paste().strip()
+            if api_key == current_key:
+                time.sleep(0.2)
+                continue
+            valid, _ = validate_api_key(api_key)
+            if valid:
+                print("✅ Found API key on clipboard!")
+                return api_key
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        # e.g. headless/SSH sessions where paste() silently returns ''
+        print("\n⌨️ Stopped watching the clipboard, falling back to paste")
+        return None
+    except pyperclip.PyperclipException as e:
+        print(f"⚠️ Clipboard not accessible ({e}), falling back to paste")
+        return None
+
+def manual_extraction(current_key=None):
     """Guide user through manual extraction"""
     print("\n🔍 Manual API Key Extraction Guide:")
     print("=" * 50)
@@ -178,11 +299,15 @@ def manual_extraction():
     print("5. CSS Selectors to inspect:")
     print("   • [data-testid*='anon']")
     print("   • [data-testid*='api-key']")
-    print("   • table tr:has-text('anon')")
     print("   • code, pre")
     print("   • .api-key, .anon-key")
+    print("   • table tr (the row labelled 'anon')")
     print()
 
+    api_key = poll_clipboard_for_key(current_key)
+    if api_key:
+        return api_key
+
     while True:
         api_key = input("🔑 Paste the anon public API key here: ").strip()
 
@@ -193,35 +318,41 @@ def manual_extraction():
             print(f"❌ Error: {message}")
             print("Please try again or press Ctrl+C to exit.")
 
-def main():
-    """Main execution function"""
+def main(manual=False, force_selenium=False):
+    """Main execution function
+
+    manual skips automated extraction; force_selenium attempts it even when
+    chromedriver is not on PATH.
+    """
     print("🚀 Supabase API Key Retrieval Script")
     print(f"📍 Project Reference: {PROJECT_REF}")
     print(f"🌐 Dashboard URL: {DASHBOARD_URL}")
     print()
 
-    # Create backup
-    create_backup()
+    # Create backup (also reads the file once for update_env_file)
+    _, env_content, env_mtime_ns = create_backup()
 
-    # Try automated extraction first
-    api_key = try_selenium_extraction()
+    # Try automated extraction first, unless the user opted out or
+    # chromedriver is missing (avoids importing Selenium for nothing)
+    api_key = None
+    if manual:
+        print("✋ --manual given, skipping automated extraction")
+    elif force_selenium or shutil.which("chromedriver"):
+        api_key = try_selenium_extraction()
+    else:
+        print("⚠️ chromedriver not found on PATH, skipping automated extraction (use --selenium to force)")
 
     # Fall back to manual extraction
     if not api_key:
         print("\n🔄 Falling back to manual extraction...")
-        api_key = manual_extraction()
-
-    # Final validation
-    valid, message = validate_api_key(api_key)
-    if not valid:
-        print(f"❌ Final validation failed: {message}")
-        sys.exit(1)
+        api_key = manual_extraction(current_anon_key(env_content))
 
+    # Both extraction paths only return keys that passed validation
     print(f"\n✅ API key validation passed")
     print(f"🔑 Key preview: {api_key[:20]}...{api_key[-20:]}")
 
     # Update .env.local file
-    update_env_file(api_key)
+    update_env_file(api_key, env_content, env_mtime_ns)
 
     print("\n🎉 Success! API key has been updated in .env.local")
     print("🔧 You can now restart your development server to use the new key")
@@ -230,12 +361,23 @@ def main():
     print(f"  grep NEXT_PUBLIC_SUPABASE_ANON_KEY {ENV_FILE}")
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] in ["--help", "-h"]:
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
         print(__doc__)
         sys.exit(0)
 
+    unknown = [arg for arg in args if arg not in ("--manual", "--selenium")]
+    if unknown:
+        print(f"❌ Unknown option(s): {' '.join(unknown)}")
+        print("Run with --help to see the available options.")
+        sys.exit(2)
+
+    if "--manual" in args and "--selenium" in args:
+        print("❌ --manual and --selenium cannot be used together")
+        sys.exit(2)
+
     try:
-        main()
+        main(manual="--manual" in args, force_selenium="--selenium" in args)
     except KeyboardInterrupt:
         print("\n👋 Script cancelled by user")
         sys.exit(0)